@@ -2,15 +2,30 @@ import asyncio
 import asyncpg
 import os
 import re
-from aiogram import Bot, Dispatcher, Router, types
+import time
+from aiogram import Bot, Dispatcher, F, Router, types
 from aiogram.filters import Command
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import (
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardRemove,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+)
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # --- ENV ---
 API_TOKEN = os.getenv("API_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Необов'язкова read-only репліка для звітів і списків адмінки
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL")
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", "10"))
+REPLICA_CHECK_INTERVAL_SECONDS = float(os.getenv("REPLICA_CHECK_INTERVAL_SECONDS", "15"))
+REPLICA_QUERY_TIMEOUT_SECONDS = float(os.getenv("REPLICA_QUERY_TIMEOUT_SECONDS", "30"))
+# На простої основна БД шле keepalive раз на wal_sender_timeout/2 (~30 с), тож поріг
+# "WAL receiver мовчить" має бути не меншим за wal_receiver_timeout (типово 60 с)
+REPLICA_WAL_RECEIVER_TIMEOUT_SECONDS = float(os.getenv("REPLICA_WAL_RECEIVER_TIMEOUT_SECONDS", "90"))
 
 if not API_TOKEN:
     raise RuntimeError("API_TOKEN відсутній у .env")
@@ -19,6 +34,7 @@ if not DATABASE_URL:
 
 print("API_TOKEN:", "***" if API_TOKEN else None)
 print("DATABASE_URL:", "***" if DATABASE_URL else None)
+print("READ_DATABASE_URL:", "***" if READ_DATABASE_URL else None)
 
 # --- Aiogram ---
 bot = Bot(token=API_TOKEN)
@@ -31,6 +47,25 @@ user_booking: dict[int, dict] = {}
 
 # --- Пул з'єднань PostgreSQL ---
 pool: asyncpg.Pool | None = None
+# Пул репліки (None, якщо READ_DATABASE_URL не задано або репліка недоступна)
+replica_pool: asyncpg.Pool | None = None
+_replica_healthy = False
+_replica_checked_at = 0.0
+_replica_warnings: set[str] = set()
+
+# Помилки з'єднання з реплікою: повторюємо на основній БД і вимикаємо репліку до наступної перевірки
+REPLICA_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.CannotConnectNowError,
+)
+# Запит скасовано на hot standby ("conflict with recovery") — лише повторюємо на основній БД
+REPLICA_QUERY_ERRORS = (
+    asyncpg.SerializationError,
+    asyncpg.QueryCanceledError,
+)
 
 # ---------- ІНІЦІАЛІЗАЦІЯ БД ----------
 CREATE_TABLES_SQL = """
@@ -70,6 +105,10 @@ ALTER TABLE programs
     ADD COLUMN IF NOT EXISTS price NUMERIC(12,2) DEFAULT 0;
 ALTER TABLE programs
     ADD COLUMN IF NOT EXISTS description TEXT DEFAULT '';
+
+-- Індекс для /my_bookings: майбутні записи конкретного користувача
+CREATE INDEX IF NOT EXISTS bookings_user_id_datetime_idx
+    ON bookings (user_id, booking_datetime);
 """
 
 async def init_db():
@@ -78,13 +117,102 @@ async def init_db():
         await conn.execute(CREATE_TABLES_SQL)
 
 # ---------- ХЕЛПЕРИ ДЛЯ БД ----------
-async def db_fetch(query: str, *args):
-    async with pool.acquire() as conn:
-        return await conn.fetch(query, *args)
+# receiving = false — WAL receiver не стрімить або давно не отримував повідомлень від
+# основної БД, тобто дані репліки старіють. Без ролі pg_read_all_stats поля
+# pg_stat_wal_receiver приховані, тому наявність ролі перевіряємо окремо.
+REPLICA_LAG_SQL = """
+SELECT
+    pg_is_in_recovery() AS in_recovery,
+    pg_has_role('pg_read_all_stats', 'USAGE') AS has_stats,
+    EXISTS (
+        SELECT 1 FROM pg_stat_wal_receiver
+        WHERE status = 'streaming'
+          AND last_msg_receipt_time > NOW() - make_interval(secs => $1::float8)
+    ) AS receiving,
+    CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END AS lag
+"""
+
+def warn_replica_once(key: str, text: str):
+    if key not in _replica_warnings:
+        _replica_warnings.add(key)
+        print(text)
+
+async def replica_available() -> bool:
+    """Чи можна зараз читати з репліки (доступна і відставання в межах норми).
 
-async def db_fetchrow(query: str, *args):
+    Результат кешується на REPLICA_CHECK_INTERVAL_SECONDS, щоб не перевіряти
+    репліку перед кожним запитом.
+    """
+    global _replica_healthy, _replica_checked_at
+    if replica_pool is None:
+        return False
+
+    now = time.monotonic()
+    if now - _replica_checked_at < REPLICA_CHECK_INTERVAL_SECONDS:
+        return _replica_healthy
+
+    try:
+        async with replica_pool.acquire(timeout=2) as conn:
+            state = await conn.fetchrow(REPLICA_LAG_SQL, REPLICA_WAL_RECEIVER_TIMEOUT_SECONDS, timeout=2)
+        if not state["in_recovery"]:
+            # Окрема БД, а не standby: звіти можуть бути неактуальними чи взагалі чужими
+            warn_replica_once(
+                "not_in_recovery",
+                "⚠ READ_DATABASE_URL вказує на БД, яка не є standby (pg_is_in_recovery() = false). "
+                "Вона не реплікується з основної — переконайтеся, що це навмисно",
+            )
+            _replica_healthy = True
+        elif not state["has_stats"]:
+            warn_replica_once(
+                "no_stats_role",
+                "⚠ Користувач репліки не має ролі pg_read_all_stats — стан реплікації не перевірити, "
+                "репліка не використовується (GRANT pg_read_all_stats TO <user>)",
+            )
+            _replica_healthy = False
+        elif not state["receiving"]:
+            print("Репліка не отримує WAL від основної БД — читаємо з основної БД")
+            _replica_healthy = False
+        else:
+            lag = float(state["lag"])
+            _replica_healthy = lag <= REPLICA_MAX_LAG_SECONDS
+            if not _replica_healthy:
+                print(f"Репліка відстає на {lag:.1f} с — читаємо з основної БД")
+    except (*REPLICA_ERRORS, asyncpg.PostgresError) as e:
+        print("Репліка недоступна:", e)
+        _replica_healthy = False
+    _replica_checked_at = now
+    return _replica_healthy
+
+def mark_replica_unhealthy():
+    global _replica_healthy, _replica_checked_at
+    _replica_healthy = False
+    _replica_checked_at = time.monotonic()
+
+async def _replica_call(method: str, query: str, *args, replica: bool = False):
+    """Виконує conn.<method> на репліці, а за її недоступності — на основній БД."""
+    if replica and await replica_available():
+        try:
+            async with replica_pool.acquire(timeout=REPLICA_QUERY_TIMEOUT_SECONDS) as conn:
+                return await getattr(conn, method)(query, *args, timeout=REPLICA_QUERY_TIMEOUT_SECONDS)
+        except REPLICA_QUERY_ERRORS as e:
+            print("Запит на репліці скасовано, повтор на основній БД:", e)
+        except (*REPLICA_ERRORS, asyncpg.PostgresError) as e:
+            # Зокрема UndefinedTableError/InsufficientPrivilegeError на окремій БД без схеми
+            print("Помилка репліки, повтор на основній БД:", e)
+            mark_replica_unhealthy()
     async with pool.acquire() as conn:
-        return await conn.fetchrow(query, *args)
+        return await getattr(conn, method)(query, *args)
+
+async def db_fetch(query: str, *args, replica: bool = False):
+    # replica=True — лише для звітів/списків; бронювання завжди читають основну БД
+    return await _replica_call("fetch", query, *args, replica=replica)
+
+async def db_fetchrow(query: str, *args, replica: bool = False):
+    return await _replica_call("fetchrow", query, *args, replica=replica)
 
 async def db_execute(query: str, *args):
     async with pool.acquire() as conn:
@@ -121,7 +249,8 @@ async def is_admin(user_id: int) -> bool:
     row = await db_fetchrow("SELECT 1 FROM admins WHERE user_id=$1", user_id)
     return bool(row)
 
-async def get_available_hours(program_id: int, booking_date: datetime.date):
+async def get_available_hours(program_id: int, booking_date: datetime.date, exclude_booking_id: int | None = None):
+    # exclude_booking_id — запис, який переноситься, не повинен блокувати сам себе
     dur_row = await db_fetchrow("SELECT duration FROM programs WHERE id=$1", program_id)
     if not dur_row:
         return []
@@ -139,8 +268,10 @@ async def get_available_hours(program_id: int, booking_date: datetime.date):
         FROM bookings b
         LEFT JOIN programs p ON p.id = b.program_id
         WHERE b.booking_datetime::date = $1
+          AND ($2::int IS NULL OR b.id <> $2)
         """,
         booking_date,
+        exclude_booking_id,
     )
 
     # Перевірка перетину інтервалів
@@ -160,6 +291,70 @@ async def get_available_hours(program_id: int, booking_date: datetime.date):
 
     return available
 
+# Advisory lock на день бронювання: вставка і перенесення записів на одну дату
+# виконуються по черзі, тож перевірка перетину і запис атомарні
+BOOKING_LOCK_NAMESPACE = 1
+
+async def lock_booking_day(conn, day: datetime.date):
+    await conn.execute("SELECT pg_advisory_xact_lock($1, $2)", BOOKING_LOCK_NAMESPACE, day.toordinal())
+
+async def create_booking(user_id: int, username: str, phone_number: str, program_id: int, car_number: str, booking_dt: datetime) -> bool:
+    """Створює запис, якщо слот вільний. False — слот уже зайнятий."""
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await lock_booking_day(conn, booking_dt.date())
+            row = await conn.fetchrow(
+                """
+                INSERT INTO bookings (user_id, username, phone_number, program_id, car_number, booking_datetime)
+                SELECT $1::bigint, $2::text, $3::text, $4::int, $5::text, $6::timestamp
+                WHERE NOT EXISTS (
+                    SELECT 1
+                    FROM bookings o
+                    LEFT JOIN programs op ON op.id = o.program_id
+                    WHERE o.booking_datetime < $6::timestamp
+                              + make_interval(mins => (SELECT duration FROM programs WHERE id = $4::int))
+                      AND o.booking_datetime + make_interval(mins => COALESCE(op.duration, 0)) > $6::timestamp
+                )
+                RETURNING id
+                """,
+                user_id, username, phone_number, program_id, car_number, booking_dt,
+            )
+    return row is not None
+
+async def move_booking(booking_id: int, user_id: int, new_dt: datetime) -> bool | None:
+    """Переносить майбутній запис користувача на new_dt.
+
+    None — запис не знайдено або він уже минув, False — новий слот зайнятий.
+    """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await lock_booking_day(conn, new_dt.date())
+            exists = await conn.fetchrow(
+                "SELECT id FROM bookings WHERE id=$1 AND user_id=$2 AND booking_datetime >= $3 FOR UPDATE",
+                booking_id, user_id, datetime.now(),
+            )
+            if not exists:
+                return None
+            row = await conn.fetchrow(
+                """
+                UPDATE bookings b
+                SET booking_datetime = $1
+                FROM programs p
+                WHERE b.id = $2 AND p.id = b.program_id
+                  AND NOT EXISTS (
+                      SELECT 1
+                      FROM bookings o
+                      LEFT JOIN programs op ON op.id = o.program_id
+                      WHERE o.id <> b.id
+                        AND o.booking_datetime < $1 + make_interval(mins => p.duration)
+                        AND o.booking_datetime + make_interval(mins => COALESCE(op.duration, 0)) > $1
+                  )
+                RETURNING b.id
+                """,
+                new_dt, booking_id,
+            )
+    return row is not None
+
 def generate_date_buttons(days_ahead=7):
     today = datetime.today().date()
     buttons = [[KeyboardButton(text=(today + timedelta(days=i)).strftime("%d.%m.%Y"))] for i in range(days_ahead)]
@@ -180,6 +375,7 @@ async def help_command(message: types.Message):
         "/help - список команд\n"
         "/programs - програми мийки\n"
         "/book - записати авто\n"
+        "/my_bookings - мої записи (скасувати або перенести)\n"
     )
     admin_text = ""
     if await is_admin(message.from_user.id):
@@ -203,7 +399,10 @@ async def list_users(message: types.Message):
         await message.answer("❌ Немає прав")
         return
 
-    rows = await db_fetch("SELECT user_id, username, phone_number, first_name, last_name, registered_at FROM users ORDER BY registered_at DESC")
+    rows = await db_fetch(
+        "SELECT user_id, username, phone_number, first_name, last_name, registered_at FROM users ORDER BY registered_at DESC",
+        replica=True,
+    )
 
     if not rows:
         await message.answer("📭 Немає зареєстрованих користувачів")
@@ -279,7 +478,8 @@ async def show_statistic(message: types.Message):
         GROUP BY p.name
         ORDER BY cnt DESC
         """,
-        start_date, end_date
+        start_date, end_date,
+        replica=True,
     )
 
     total_count = sum(r["cnt"] for r in rows)
@@ -454,7 +654,8 @@ async def show_booking(message: types.Message):
             FROM bookings b
             LEFT JOIN programs p ON p.id = b.program_id
             ORDER BY b.booking_datetime
-            """
+            """,
+            replica=True,
         )
     else:
         query = args[1].strip()
@@ -472,6 +673,7 @@ async def show_booking(message: types.Message):
                 ORDER BY b.booking_datetime
                 """,
                 date,
+                replica=True,
             )
         except ValueError:
             # user_id
@@ -486,6 +688,7 @@ async def show_booking(message: types.Message):
                     ORDER BY b.booking_datetime
                     """,
                     int(query),
+                    replica=True,
                 )
             else:
                 # номер авто
@@ -499,6 +702,7 @@ async def show_booking(message: types.Message):
                     ORDER BY b.booking_datetime
                     """,
                     query.upper(),
+                    replica=True,
                 )
 
     if not rows:
@@ -580,6 +784,102 @@ async def book_program(message: types.Message):
     await message.answer("Оберіть програму:", reply_markup=keyboard)
     user_booking[message.from_user.id] = {}
 
+async def get_user_upcoming_bookings(user_id: int):
+    # Завжди з основної БД, щоб щойно скасовані/перенесені записи одразу зникали
+    return await db_fetch(
+        """
+        SELECT b.id, b.program_id, p.name AS program_name, b.car_number, b.booking_datetime
+        FROM bookings b
+        LEFT JOIN programs p ON p.id = b.program_id
+        WHERE b.user_id = $1 AND b.booking_datetime >= $2
+        ORDER BY b.booking_datetime
+        """,
+        user_id,
+        datetime.now(),
+    )
+
+@router.message(Command("my_bookings"))
+async def my_bookings(message: types.Message):
+    rows = await get_user_upcoming_bookings(message.from_user.id)
+    if not rows:
+        await message.answer("📭 У вас немає майбутніх записів. Записатися: /book")
+        return
+
+    await message.answer("📋 Ваші записи:")
+    for r in rows[:20]:  # кожен запис — окреме повідомлення, тож обмежимо кількість
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="❌ Скасувати", callback_data=f"my_cancel:{r['id']}"),
+            InlineKeyboardButton(text="🔁 Перенести", callback_data=f"my_resched:{r['id']}"),
+        ]])
+        await message.answer(
+            f"ID: {r['id']}\n"
+            f"📅 {r['booking_datetime'].strftime('%d.%m.%Y %H:%M')}\n"
+            f"🧾 Програма: {r['program_name'] or '—'}\n"
+            f"🚗 {r['car_number']}",
+            reply_markup=kb,
+        )
+    if len(rows) > 20:
+        await message.answer(f"… і ще {len(rows) - 20} запис(ів)")
+
+@router.callback_query(F.data.startswith("my_cancel:"))
+async def cancel_my_booking(callback: types.CallbackQuery):
+    try:
+        booking_id = int(callback.data.split(":", 1)[1])
+    except ValueError:
+        await callback.answer("❌ Невірний запит")
+        return
+
+    # DELETE на основній БД — слот одразу стає вільним для get_available_hours
+    row = await db_fetchrow(
+        "DELETE FROM bookings WHERE id=$1 AND user_id=$2 AND booking_datetime >= $3 RETURNING id",
+        booking_id,
+        callback.from_user.id,
+        datetime.now(),
+    )
+    if not row:
+        await callback.answer("❌ Запис не знайдено або він уже минув", show_alert=True)
+        return
+
+    await callback.answer("Запис скасовано")
+    text = f"🗑 Запис {booking_id} скасовано"
+    try:
+        await callback.message.edit_text(text)
+    except Exception:
+        # Старі (>48 год) або недоступні повідомлення не редагуються
+        await bot.send_message(callback.from_user.id, text)
+
+@router.callback_query(F.data.startswith("my_resched:"))
+async def reschedule_my_booking(callback: types.CallbackQuery):
+    try:
+        booking_id = int(callback.data.split(":", 1)[1])
+    except ValueError:
+        await callback.answer("❌ Невірний запит")
+        return
+
+    row = await db_fetchrow(
+        "SELECT id, program_id FROM bookings WHERE id=$1 AND user_id=$2 AND booking_datetime >= $3",
+        booking_id,
+        callback.from_user.id,
+        datetime.now(),
+    )
+    if not row:
+        await callback.answer("❌ Запис не знайдено або він уже минув", show_alert=True)
+        return
+    if row["program_id"] is None:
+        await callback.answer("❌ Програму цього запису видалено, перенесення неможливе", show_alert=True)
+        return
+
+    # Далі працює звичайний сценарій process_booking, починаючи з вибору дати
+    user_booking[callback.from_user.id] = {
+        "program_id": row["program_id"],
+        "reschedule_id": booking_id,
+    }
+    await callback.answer()
+    await callback.message.answer(
+        f"🔁 Перенесення запису {booking_id}. Оберіть нову дату:",
+        reply_markup=generate_date_buttons(),
+    )
+
 @router.message()
 async def process_booking(message: types.Message):
     user_id = message.from_user.id
@@ -609,7 +909,7 @@ async def process_booking(message: types.Message):
             await message.answer("❌ Невірна дата")
             return
 
-        hours = await get_available_hours(data["program_id"], data["booking_date"])
+        hours = await get_available_hours(data["program_id"], data["booking_date"], data.get("reschedule_id"))
         if not hours:
             await message.answer("❌ Немає вільних годин, оберіть іншу дату", reply_markup=generate_date_buttons())
             data.pop("booking_date")
@@ -621,11 +921,50 @@ async def process_booking(message: types.Message):
 
     # 3) Час
     if "booking_time" not in data:
-        hours = await get_available_hours(data["program_id"], data["booking_date"])
+        hours = await get_available_hours(data["program_id"], data["booking_date"], data.get("reschedule_id"))
         if message.text not in hours:
             await message.answer("❌ Ця година вже зайнята")
             return
         data["booking_time"] = message.text
+
+        # Перенесення існуючого запису: авто і телефон уже відомі
+        if "reschedule_id" in data:
+            booking_dt = datetime.combine(
+                data["booking_date"],
+                datetime.strptime(data["booking_time"], "%H:%M").time()
+            )
+            if booking_dt <= datetime.now():
+                await message.answer("❌ Ця година вже минула, оберіть іншу")
+                data.pop("booking_time")
+                return
+            moved = await move_booking(data["reschedule_id"], user_id, booking_dt)
+            if moved is False:
+                # Слот щойно зайняли — пропонуємо актуальні години
+                data.pop("booking_time")
+                hours = await get_available_hours(data["program_id"], data["booking_date"], data["reschedule_id"])
+                if not hours:
+                    user_booking.pop(user_id, None)
+                    await message.answer(
+                        "❌ Цю годину щойно зайняли, вільних годин на цю дату немає. Спробуйте ще раз: /my_bookings",
+                        reply_markup=ReplyKeyboardRemove()
+                    )
+                    return
+                buttons = [[KeyboardButton(text=h)] for h in hours]
+                await message.answer(
+                    "❌ Цю годину щойно зайняли, оберіть іншу:",
+                    reply_markup=ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+                )
+                return
+            user_booking.pop(user_id, None)
+            if moved is None:
+                await message.answer("❌ Запис не знайдено або він уже минув", reply_markup=ReplyKeyboardRemove())
+                return
+            await message.answer(
+                f"✅ Запис {data['reschedule_id']} перенесено на {booking_dt.strftime('%d.%m.%Y %H:%M')}",
+                reply_markup=ReplyKeyboardRemove()
+            )
+            return
+
         await message.answer("Введіть номер авто:", reply_markup=ReplyKeyboardRemove())
         return
 
@@ -659,11 +998,7 @@ async def process_booking(message: types.Message):
         )
         username = message.from_user.username or "Не вказано"
 
-        await db_execute(
-            """
-            INSERT INTO bookings (user_id, username, phone_number, program_id, car_number, booking_datetime)
-            VALUES ($1, $2, $3, $4, $5, $6)
-            """,
+        created = await create_booking(
             user_id,
             username,
             data["phone_number"],
@@ -671,6 +1006,10 @@ async def process_booking(message: types.Message):
             data["car_number"],
             booking_dt,
         )
+        if not created:
+            user_booking.pop(user_id, None)
+            await message.answer("❌ Цю годину щойно зайняли. Спробуйте ще раз: /book", reply_markup=ReplyKeyboardRemove())
+            return
 
         await message.answer(
             f"✅ Запис підтверджено:\n"
@@ -685,10 +1024,26 @@ async def process_booking(message: types.Message):
 
 # ---------- СТАРТ ----------
 async def main():
-    global pool
+    global pool, replica_pool
     # SSL для Supabase зазвичай не потрібен явно в URI, але якщо у вас вимагає — додайте ?sslmode=require
     pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
     await init_db()
+    if READ_DATABASE_URL:
+        try:
+            # min_size=0: з'єднання створюються ліниво, тож репліка, недоступна під час
+            # старту, підхопиться наступною перевіркою replica_available()
+            replica_pool = await asyncpg.create_pool(
+                READ_DATABASE_URL,
+                min_size=0,
+                max_size=5,
+                command_timeout=REPLICA_QUERY_TIMEOUT_SECONDS,
+            )
+        except Exception as e:
+            # Без репліки бот працює як раніше — усе читається з основної БД
+            print("Не вдалося підключитися до репліки:", e)
+            replica_pool = None
+        # Перша перевірка одразу під час старту, щоб попередження про конфігурацію було видно в логах
+        await replica_available()
     dp.include_router(router)
     await dp.start_polling(bot)
 